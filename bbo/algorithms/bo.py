@@ -3,11 +3,12 @@ from typing import List, Sequence, Optional, Union
 
 from attrs import define, field, validators, evolve
 import numpy as np
+from scipy.optimize import minimize
 import torch
 from torch import optim
 
 import botorch
-from botorch import fit_gpytorch_mll
+from botorch.optim.fit import fit_gpytorch_mll_scipy
 from botorch.models import SingleTaskGP
 from botorch.optim.initializers import initialize_q_batch_nonneg
 import gpytorch
@@ -23,14 +24,91 @@ from bbo.utils.problem_statement import ProblemStatement, Objective
 from bbo.utils.trial import Trial, is_better_than
 from bbo.algorithms.bo_utils.mean_factory import MeanFactory
 from bbo.algorithms.bo_utils.kernel_factory import KernelFactory
-from bbo.algorithms.bo_utils.acqf_factory import acqf_factory
+from bbo.algorithms.bo_utils.acqf_factory import acqf_factory, MultiOutputAcquisitionFunction
 from bbo.algorithms.evolution.nsgaii import NSGAIIDesigner
 from bbo.algorithms.evolution.regularized_evolution import RegularizedEvolutionDesigner
 from bbo.benchmarks.experimenters.torch_experimenter import TorchExperimenter
 
+try:
+    from greenlet import greenlet
+except ImportError:
+    greenlet = None
+
 logger = logging.getLogger(__name__)
 
 
+def _batched_optimize_acqf(acqf, X0, bounds, options=None):
+    """Run one L-BFGS-B per restart while evaluating all restarts in one batch
+
+    Each restart drives its own scipy.optimize.minimize inside a greenlet and
+    switches back to the main loop whenever it requests a point, so that the
+    acqf value and gradient of all pending restarts are computed in a single
+    forward and backward pass. Returns the final candidates together with their
+    acqf values reported by the optimizer, so no extra evaluation is needed.
+    """
+    num_restarts, q, d = X0.shape
+    bounds = np.tile(bounds.T.cpu().numpy(), (q, 1))
+    main = greenlet.getcurrent()
+
+    def f_and_grad(x):
+        return main.switch(x)
+
+    def run(x0):
+        res = minimize(f_and_grad, x0, jac=True, method='L-BFGS-B', bounds=bounds, options=options)
+        return res.x, res.fun
+
+    workers = [greenlet(run) for _ in range(num_restarts)]
+    x0 = X0.detach().reshape(num_restarts, -1).cpu().numpy()
+    pending, results = dict(), dict()
+    for i, worker in enumerate(workers):
+        out = worker.switch(x0[i])
+        if worker.dead:
+            results[i] = out
+        else:
+            pending[i] = out
+
+    while pending:
+        idx = list(pending)
+        X = torch.as_tensor(np.stack([pending[i] for i in idx]), dtype=X0.dtype, device=X0.device)
+        X = X.reshape(len(idx), q, d).requires_grad_(True)
+        Y = acqf(X)
+        grad, = torch.autograd.grad(Y.sum(), X)
+        f = - Y.detach().cpu().double().numpy()
+        g = - grad.reshape(len(idx), -1).cpu().double().numpy()
+        for k, i in enumerate(idx):
+            out = workers[i].switch((f[k].item(), g[k]))
+            if workers[i].dead:
+                results[i] = out
+                del pending[i]
+            else:
+                pending[i] = out
+
+    X = np.stack([results[i][0] for i in range(num_restarts)])
+    Y = - np.array([results[i][1] for i in range(num_restarts)])
+    X = torch.as_tensor(X, dtype=X0.dtype, device=X0.device).reshape(num_restarts, q, d)
+    return X, torch.as_tensor(Y, dtype=X0.dtype, device=X0.device)
+
+
+def _row_keys(X: np.ndarray) -> np.ndarray:
+    """View each row of a 2D array as a single hashable/sortable void item"""
+    X = np.ascontiguousarray(X, dtype=np.float64)
+    return X.view(np.dtype((np.void, X.dtype.itemsize * X.shape[1]))).ravel()
+
+
+def _build_next_x(pareto_X: np.ndarray, pop_X: np.ndarray, q: int, rng: np.random.Generator):
+    """Select at most q rows for the next batch
+
+    Rows are drawn from the Pareto set first and, if it has fewer than q rows,
+    from the population rows that are not in the Pareto set. Returns the selected
+    indices into pareto_X and pop_X.
+    """
+    if len(pareto_X) >= q:
+        return rng.choice(len(pareto_X), q, replace=False, shuffle=False), np.zeros(0, dtype=int)
+    diff_idx = np.flatnonzero(~np.isin(_row_keys(pop_X), _row_keys(pareto_X)))
+    quota = min(len(diff_idx), q - len(pareto_X))
+    return np.arange(len(pareto_X)), rng.choice(diff_idx, quota, replace=False, shuffle=False)
+
+
 @define
 class BODesigner(Designer):
     _problem_statement: ProblemStatement = field(
@@ -39,6 +117,11 @@ class BODesigner(Designer):
     _n_init: int = field(default=10, kw_only=True)
     _q: int = field(default=1, kw_only=True)
     _device: str = field(default='cpu', kw_only=True)
+    _dtype: Optional[torch.dtype] = field(default=None, kw_only=True)
+    _seed: Optional[int] = field(
+        default=None, kw_only=True,
+        validator=validators.optional(validators.instance_of(int)),
+    )
 
     # surrogate model configuration
     _mean_factory: MeanFactory = field(default=MeanFactory('constant'), kw_only=True)
@@ -67,14 +150,38 @@ class BODesigner(Designer):
         validator=validators.in_(['random', 'adam', 'l-bfgs', 'pso', 'nsgaii', 're'])
     )
     _acqf_config: dict = field(factory=dict, kw_only=True)
+    # 'joint' lets the acqf optimizer propose the batch, 'kb' builds it
+    # sequentially with the Kriging Believer heuristic
+    _acqf_strategy: str = field(
+        default='joint', kw_only=True,
+        validator=validators.in_(['joint', 'kb'])
+    )
     
     _init_designer: Designer = field(init=False)
+    _rng: np.random.Generator = field(init=False)
+    _nsgaii_problem_statement: Optional[ProblemStatement] = field(default=None, init=False)
+    _nsgaii_pop_size: int = field(default=20, init=False)
+    _nsgaii_n_offsprings: int = field(default=20, init=False)
     _converter: BaseTrialConverter = field(init=False)
     _type2bounds = field(init=False)
     _type2num = field(init=False)
+    _feature_keys = field(init=False)
+    _last_state_dict: Optional[dict] = field(default=None, init=False)
+    _X_buf: np.ndarray = field(init=False)
+    _Y_buf: np.ndarray = field(init=False)
+    # running count, mean and sum of squared deviations of the labels
+    _y_n: int = field(default=0, init=False)
+    _y_mean: np.ndarray = field(init=False)
+    _y_m2: np.ndarray = field(init=False)
+    _pinned_bufs: dict = field(factory=dict, init=False)
+    _bounds: torch.Tensor = field(init=False)
+    _dtype_given: bool = field(init=False)
 
     def __attrs_post_init__(self):
+        if self._acqf_strategy == 'kb' and self._acqf_optimizer == 'nsgaii':
+            raise ValueError('Kriging Believer requires a single-point acqf optimizer')
         self._init_designer = RandomDesigner(self._problem_statement)
+        self._rng = np.random.default_rng(self._seed)
         self._converter = GroupedFeatureTrialConverter.from_problem(self._problem_statement)
 
         type2bounds = {k: {'lb': [], 'ub': []} for k in SpecType}
@@ -92,8 +199,86 @@ class BODesigner(Designer):
         self._type2num = dict()
         for k in type2bounds:
             self._type2num[k] = len(type2bounds[k]['lb'])
+        self._feature_keys = tuple(k.name for k in SpecType)
 
         self._device = torch.device(self._device if torch.cuda.is_available() else 'cpu')
+        self._dtype_given = self._dtype is not None
+        if self._dtype is None:
+            self._dtype = torch.float32 if self._device.type == 'cuda' else torch.float64
+        lb = torch.cat([bounds['lb'] for bounds in type2bounds.values()])
+        ub = torch.cat([bounds['ub'] for bounds in type2bounds.values()])
+        self._bounds = torch.stack([lb, ub], dim=0).to(self._device, self._dtype).contiguous()
+
+        self._X_buf, self._Y_buf = self._trials_to_arrays(self._trials)
+        self._init_moments()
+
+        if self._acqf_optimizer == 'nsgaii':
+            obj = Objective()
+            if isinstance(self._acqf_type, list):
+                for name in self._acqf_type:
+                    obj.add_metric(name, ObjectiveMetricGoal.MAXIMIZE)
+            else:
+                obj.add_metric(self._acqf_type, ObjectiveMetricGoal.MAXIMIZE)
+            if obj.num_metrics() <= 1:
+                logger.warning('NSGA-II is a multi-objective optimization algorithm, but only single objective is defined')
+            self._nsgaii_problem_statement = ProblemStatement(self._problem_statement.search_space, obj)
+            self._nsgaii_pop_size = self._acqf_config.get('pop_size', 20)
+            self._nsgaii_n_offsprings = self._acqf_config.get('n_offsprings', None) or self._nsgaii_pop_size
+
+    def _make_nsgaii_designer(self) -> NSGAIIDesigner:
+        return NSGAIIDesigner(
+            self._nsgaii_problem_statement,
+            pop_size=self._nsgaii_pop_size,
+            n_offsprings=self._nsgaii_n_offsprings,
+        )
+
+    def _features_to_array(self, features) -> np.ndarray:
+        return np.concatenate([features[k] for k in self._feature_keys], axis=-1, dtype=np.float64)
+
+    def _trials_to_arrays(self, trials: Sequence[Trial]):
+        features, labels = self._converter.convert(trials)
+        X = self._features_to_array(features)
+        Y = []
+        metric_informations = self._problem_statement.objective.metric_informations
+        for v, metric_info in zip(labels.values(), metric_informations.values()):
+            if metric_info.goal == ObjectiveMetricGoal.MINIMIZE:
+                v = -v
+            Y.append(v.reshape(-1, 1))
+        Y = np.concatenate(Y, axis=-1)
+        return X, Y
+
+    def _init_moments(self):
+        self._y_n = 0
+        self._y_mean = np.zeros(self._Y_buf.shape[-1])
+        self._y_m2 = np.zeros(self._Y_buf.shape[-1])
+        self._update_moments(self._Y_buf)
+
+    def _update_moments(self, Y: np.ndarray):
+        # Chan et al.'s batched form of Welford's algorithm
+        n_b = Y.shape[0]
+        if n_b == 0:
+            return
+        mean_b = Y.mean(axis=0)
+        m2_b = ((Y - mean_b) ** 2).sum(axis=0)
+        n = self._y_n + n_b
+        delta = mean_b - self._y_mean
+        self._y_mean = self._y_mean + delta * n_b / n
+        self._y_m2 = self._y_m2 + m2_b + delta ** 2 * self._y_n * n_b / n
+        self._y_n = n
+
+    def _to_device(self, name: str, array: np.ndarray) -> torch.Tensor:
+        if self._device.type != 'cuda':
+            return torch.as_tensor(array, dtype=self._dtype, device=self._device)
+        # stage the array in a reusable page-locked host buffer so that the
+        # host-to-device copy can be issued asynchronously
+        buf = self._pinned_bufs.get(name)
+        if buf is None or buf.shape[0] < array.shape[0] or buf.shape[1:] != array.shape[1:]:
+            shape = (max(2 * array.shape[0], 1),) + array.shape[1:]
+            buf = torch.empty(shape, dtype=self._dtype, pin_memory=True)
+            self._pinned_bufs[name] = buf
+        pinned = buf[:array.shape[0]]
+        pinned.copy_(torch.from_numpy(array))
+        return pinned.to(self._device, non_blocking=True)
 
     def create_model(self, train_X, train_Y):
         mean_module = self._mean_factory()
@@ -104,19 +289,26 @@ class BODesigner(Designer):
         # logger.info('='*20)
         model = SingleTaskGP(train_X, train_Y, covar_module=covar_module, mean_module=mean_module).to(self._device)
         model.likelihood.noise_covar.register_constraint('raw_noise', GreaterThan(1e-4))
+        if self._last_state_dict is not None:
+            # warm start from the hyperparameters fitted in the last iteration
+            shapes = {k: v.shape for k, v in model.named_parameters()}
+            if all(shapes.get(k) == v.shape for k, v in self._last_state_dict.items()):
+                model.load_state_dict(self._last_state_dict, strict=False)
         mll = gpytorch.mlls.ExactMarginalLogLikelihood(model.likelihood, model)
 
         return mll, model
 
     def optimize_model(self, mll, model, train_X, train_Y):
         if self._mll_optimizer == 'l-bfgs':
-            fit_gpytorch_mll(mll)
+            mll.train()
+            fit_gpytorch_mll_scipy(mll, options={'maxiter': self._mll_epochs or 100, 'ftol': 1e-8})
+            mll.eval()
         elif self._mll_optimizer == 'adam':
             optimizer = optim.Adam(model.parameters(), lr=self._mll_lr)
             model.train()
             model.likelihood.train()
             for _ in range(self._mll_epochs):
-                optimizer.zero_grad()
+                optimizer.zero_grad(set_to_none=True)
                 output = model(train_X)
                 loss = - mll(output, train_Y.reshape(-1))
                 loss.backward()
@@ -128,10 +320,10 @@ class BODesigner(Designer):
 
     def create_acqf(self, model, train_X, train_Y):
         if isinstance(self._acqf_type, list):
-            acqf = []
-            for acqf_type in self._acqf_type:
-                acqf_tmp = acqf_factory(acqf_type, model, train_X, train_Y)
-                acqf.append(acqf_tmp)
+            acqf = MultiOutputAcquisitionFunction(
+                model,
+                [acqf_factory(acqf_type, model, train_X, train_Y) for acqf_type in self._acqf_type]
+            )
         else:
             acqf = acqf_factory(self._acqf_type, model, train_X, train_Y)
             
@@ -140,12 +332,13 @@ class BODesigner(Designer):
     def optimize_acqf(self, acqf) -> Sequence[Trial]:
         if self._acqf_optimizer in ['random', 'adam', 'l-bfgs']:
             num_restarts = 10
-            lb = torch.cat([bounds['lb'] for bounds in self._type2bounds.values()]).to(self._device)
-            ub = torch.cat([bounds['ub'] for bounds in self._type2bounds.values()]).to(self._device)
-            Xraw = lb + (ub - lb) * torch.rand(100*num_restarts, 1, len(lb)).to(self._device)
-            Yraw = acqf(Xraw)
+            lb, ub = self._bounds
+            Xraw = lb + (ub - lb) * torch.rand(100*num_restarts, 1, len(lb), dtype=self._dtype, device=self._device)
+            with torch.no_grad():
+                Yraw = acqf(Xraw)
             cand_X = initialize_q_batch_nonneg(Xraw, Yraw, num_restarts)
             cand_X.requires_grad_(True)
+            cand_Y = None
 
             if self._acqf_optimizer == 'random':
                 pass
@@ -156,9 +349,21 @@ class BODesigner(Designer):
                     loss = - acqf(cand_X).mean()
                     loss.backward()
                     optimizer.step()
-                    for j, (l, u) in enumerate(zip(lb, ub)):
-                        cand_X.data[..., j].clamp_(l, u)
+                    cand_X.data.clamp_(lb, ub)
+            elif self._acqf_optimizer == 'l-bfgs' and greenlet is not None:
+                # 'maxiter' bounds the L-BFGS-B iterations of each restart, while 'lr'
+                # and 'epochs' only configure the torch LBFGS fallback
+                unused = [k for k in ('lr', 'epochs') if k in self._acqf_config]
+                if unused:
+                    logger.warning('acqf_config {} is ignored by the L-BFGS-B acqf optimizer, use maxiter instead'.format(unused))
+                cand_X, cand_Y = _batched_optimize_acqf(
+                    acqf, cand_X, self._bounds,
+                    options={'maxiter': self._acqf_config.get('maxiter', 200)}
+                )
             elif self._acqf_optimizer == 'l-bfgs':
+                # fallback for environments without greenlet, this is a different
+                # algorithm: one joint torch LBFGS over the mean acqf of all restarts
+                logger.warning('greenlet is not installed, fall back to torch LBFGS for acqf optimization')
                 optimizer = torch.optim.LBFGS([cand_X], lr=self._acqf_config.get('lr', 0.01))
                 def closure():
                     optimizer.zero_grad()
@@ -167,12 +372,13 @@ class BODesigner(Designer):
                     return loss
                 for i in range(self._acqf_config.get('epochs', 50)):
                     optimizer.step(closure)
-                    for j, (l, u) in enumerate(zip(lb, ub)):
-                        cand_X.data[..., j].clamp_(l, u)
+                    cand_X.data.clamp_(lb, ub)
             else:
                 raise NotImplementedError('Unsupported acqf optimizer')
 
-            cand_Y = acqf(cand_X)
+            if cand_Y is None:
+                with torch.no_grad():
+                    cand_Y = acqf(cand_X)
             cand_X = cand_X[cand_Y.argmax()]
             next_X_np = cand_X.detach().to('cpu').numpy()
             grouped_features = dict()
@@ -188,8 +394,9 @@ class BODesigner(Designer):
             obj.add_metric(self._acqf_type, ObjectiveMetricGoal.MAXIMIZE)
             pso_problem_statement = ProblemStatement(sp, obj)
             experimenter = TorchExperimenter(
-                lambda x: acqf(x.unsqueeze(1).to(self._device)).unsqueeze(-1),
-                pso_problem_statement
+                lambda x: acqf(x.unsqueeze(1)).unsqueeze(-1),
+                pso_problem_statement,
+                device=self._device, dtype=self._dtype
             )
             best_trial = None
             for _ in range(self._acqf_config.get('num_restarts', 1)):
@@ -203,56 +410,61 @@ class BODesigner(Designer):
                     best_trial = cand_best_trial
             next_X = [best_trial]
         elif self._acqf_optimizer == 'nsgaii':
-            sp = self._problem_statement.search_space
-            obj = Objective()
-            if isinstance(self._acqf_type, list):
-                for name in self._acqf_type:
-                    obj.add_metric(name, ObjectiveMetricGoal.MAXIMIZE)
-            else:
-                obj.add_metric(self._acqf_type, ObjectiveMetricGoal.MAXIMIZE)
-            if obj.num_metrics() <= 1:
-                logger.warning('NSGA-II is a multi-objective optimization algorithm, but only single objective is defined')
-            nsgaii_problem_statement = ProblemStatement(sp, obj)
-            nsgaii_designer = NSGAIIDesigner(
-                nsgaii_problem_statement,
-                pop_size=self._acqf_config.get('pop_size', 20),
-                n_offsprings=self._acqf_config.get('n_offsprings', None),
+            nsgaii_problem_statement = self._nsgaii_problem_statement
+            nsgaii_designer = self._make_nsgaii_designer()
+            n_obj = nsgaii_problem_statement.objective.num_metrics()
+            # the output buffer is shared by all generations, and the experimenter
+            # copies the values into the trials before the next evaluation
+            acq_buf = torch.empty(
+                max(self._nsgaii_pop_size, self._nsgaii_n_offsprings), n_obj,
+                dtype=self._dtype, device=self._device
             )
-            def acqf_obj(x, acqf):
-                if not isinstance(acqf, (tuple, list)):
-                    acqf = [acqf]
-                y = []
-                for acqf_tmp in acqf:
-                    y.append(acqf_tmp(x.unsqueeze(1).to(self._device)).unsqueeze(-1))
-                y = torch.hstack(y)
+            # the population shape is fixed across generations, so a compiled acqf is
+            # only traced once per shape, but tracing takes seconds and pays off only
+            # for long runs, hence it is opt-in
+            acqf_eval = acqf
+            if self._acqf_config.get('compile', False):
+                acqf_eval = torch.compile(
+                    acqf, dynamic=False,
+                    mode=self._acqf_config.get('compile_mode', 'reduce-overhead')
+                )
+            def acqf_obj(x):
+                if isinstance(x, np.ndarray):
+                    x = torch.as_tensor(x, dtype=self._dtype, device=self._device)
+                # evaluate the whole population as a b x q x d batch with q=1
+                xq = x.reshape(x.shape[0], 1, x.shape[-1])
+                y = acq_buf[:x.shape[0]]
+                with torch.no_grad():
+                    y.copy_(acqf_eval(xq).reshape(-1, n_obj))
                 return y
-            experimenter = TorchExperimenter(lambda x: acqf_obj(x, acqf), nsgaii_problem_statement)
-            for _ in range(self._acqf_config.get('epochs', 200)):
-                trials = nsgaii_designer.suggest()
-                experimenter.evaluate(trials)
-                nsgaii_designer.update(trials)
+            experimenter = TorchExperimenter(
+                acqf_obj, nsgaii_problem_statement,
+                device=self._device, dtype=self._dtype
+            )
+            model = acqf.model
+            model.eval()
+            with gpytorch.settings.fast_pred_var():
+                # warm up the prediction strategy cache of the GP once, so that all
+                # generations reuse the same train-data-dependent solves
+                with torch.no_grad():
+                    model.posterior(model.train_inputs[0][:1])
+                for _ in range(self._acqf_config.get('epochs', 200)):
+                    trials = nsgaii_designer.suggest()
+                    experimenter.evaluate(trials)
+                    nsgaii_designer.update(trials)
 
             # generate next_X for batch BO setting
             pareto_trials = nsgaii_designer.result()
-            pareto_trials = [evolve(i, metrics=None) for i in pareto_trials]
             pop_trials = nsgaii_designer.curr_pop()
-            pop_trials = [evolve(i, metrics=None) for i in pop_trials]
-            diff_trials = [x for x in pop_trials if x not in pareto_trials]
-            next_X = []
-
-            if len(pareto_trials) >= self._q:
-                idx = np.random.choice(len(pareto_trials), self._q, replace=False)
-                next_X.extend([pareto_trials[i] for i in idx])
-            else:
-                next_X.extend(pareto_trials)
-                if len(diff_trials) > 0:
-                    quota = min(len(diff_trials), self._q-len(pareto_trials))
-                    idx = np.random.choice(len(diff_trials), quota, replace=False)
-                    next_X.extend([diff_trials[i] for i in idx])
-                quota = self._q - np.vstack(next_X).shape[0]
-                if quota > 0:
-                    trials = self._init_designer.suggest(quota)
-                    next_X.extend(trials)
+            pareto_X = self._features_to_array(self._converter.to_features(pareto_trials))
+            pop_X = self._features_to_array(self._converter.to_features(pop_trials))
+            pareto_idx, pop_idx = _build_next_x(pareto_X, pop_X, self._q, self._rng)
+            next_X = [evolve(pareto_trials[i], metrics=None) for i in pareto_idx]
+            next_X.extend([evolve(pop_trials[i], metrics=None) for i in pop_idx])
+            quota = self._q - len(next_X)
+            if quota > 0:
+                trials = self._init_designer.suggest(quota)
+                next_X.extend(trials)
         elif self._acqf_optimizer == 're':
             sp = self._problem_statement.search_space
             obj = Objective()
@@ -260,8 +472,9 @@ class BODesigner(Designer):
             re_problem_statement = ProblemStatement(sp, obj)
             re_designer = RegularizedEvolutionDesigner(re_problem_statement)
             experimenter = TorchExperimenter(
-                lambda x: acqf(x.unsqueeze(1).to(self._device)).unsqueeze(-1), 
-                re_problem_statement
+                lambda x: acqf(x.unsqueeze(1)).unsqueeze(-1),
+                re_problem_statement,
+                device=self._device, dtype=self._dtype
             )
             for _ in range(self._acqf_config.get('epochs', 200)):
                 trials = re_designer.suggest()
@@ -279,34 +492,71 @@ class BODesigner(Designer):
             next_X = self._init_designer.suggest(count)
         else:
             count = count or 1
-            features, labels = self._converter.convert(self._trials)
-
-            train_X = []
-            for k in SpecType:
-                train_X.append(torch.from_numpy(features[k.name]))
-            train_X = torch.cat(train_X, dim=-1).to(self._device)
-
-            train_Y = []
-            metric_informations = self._problem_statement.objective.metric_informations
-            for v, metric_info in zip(labels.values(), metric_informations.values()):
-                if metric_info.goal == ObjectiveMetricGoal.MINIMIZE:
-                    v = -v
-                train_Y.append(v)
-            train_Y = np.concatenate(train_Y, axis=-1)
-            if train_Y.shape[-1] > 1:
+            if self._Y_buf.shape[-1] > 1:
                 raise NotImplementedError('Unsupported for multiobjective BO')
-            train_Y = (train_Y - train_Y.mean()) / (train_Y.std() + 1e-6)
-            train_Y = torch.from_numpy(train_Y).double().to(self._device)
-        
+            try:
+                next_X = self._fit_and_optimize(*self._training_data())
+            except torch.cuda.OutOfMemoryError:
+                logger.warning('CUDA out of memory, fall back to CPU')
+                self._device = torch.device('cpu')
+                if not self._dtype_given:
+                    self._dtype = torch.float64
+                self._bounds = self._bounds.to(self._device, self._dtype)
+                next_X = self._fit_and_optimize(*self._training_data())
+
+        return next_X
+
+    def _training_data(self):
+        train_X = self._to_device('X', self._X_buf)
+        mean = torch.as_tensor(self._y_mean, dtype=self._dtype, device=self._device)
+        std = torch.as_tensor(self._y_m2 / self._y_n, dtype=self._dtype, device=self._device)
+        std = std.sqrt_().clamp_min_(1e-6)
+        # the subtraction allocates the output (the raw tensor may share memory
+        # with _Y_buf on CPU), and the division is done in place
+        train_Y = (self._to_device('Y', self._Y_buf) - mean).div_(std)
+        return train_X, train_Y
+
+    def _fit_and_optimize(self, train_X, train_Y) -> Sequence[Trial]:
+        # float32 is used on GPU, which needs a larger jitter to keep the Cholesky
+        # stable, the float64 jitter keeps gpytorch's default
+        with gpytorch.settings.cholesky_jitter(float_value=1e-4):
             mll, model = self.create_model(train_X, train_Y)
             self.optimize_model(mll, model, train_X, train_Y)
+            self._last_state_dict = {k: v.detach().clone() for k, v in model.named_parameters()}
+            if self._acqf_strategy == 'kb':
+                return self._kriging_believer(model, train_X, train_Y)
             acqf = self.create_acqf(model, train_X, train_Y)
-            next_X = self.optimize_acqf(acqf)
+            return self.optimize_acqf(acqf)
+
+    def _kriging_believer(self, model, train_X, train_Y) -> Sequence[Trial]:
+        """Select q points one at a time
 
+        After each point is selected, the model is conditioned on its posterior
+        mean at that point as a fantasy observation, without refitting.
+        """
+        next_X = []
+        for i in range(self._q):
+            acqf = self.create_acqf(model, train_X, train_Y)
+            trials = self.optimize_acqf(acqf)
+            next_X.extend(trials)
+            if i == self._q - 1:
+                break
+            cand_X = self._features_to_array(self._converter.to_features(trials))
+            cand_X = torch.as_tensor(cand_X, dtype=self._dtype, device=self._device)
+            with torch.no_grad():
+                fantasy_Y = model.posterior(cand_X).mean
+                model = model.condition_on_observations(cand_X, fantasy_Y)
+            train_X = torch.cat([train_X, cand_X], dim=0)
+            train_Y = torch.cat([train_Y, fantasy_Y], dim=0)
         return next_X
 
     def _update(self, completed: Sequence[Trial]) -> None:
-        pass
+        X, Y = self._trials_to_arrays(completed)
+        self._X_buf = np.concatenate([self._X_buf, X], axis=0)
+        self._Y_buf = np.concatenate([self._Y_buf, Y], axis=0)
+        self._update_moments(Y)
 
     def _reset(self, trials: Sequence[Trial]=None):
-        pass
+        self._X_buf, self._Y_buf = self._trials_to_arrays(self._trials)
+        self._init_moments()
+        self._last_state_dict = None
@@ -1,9 +1,38 @@
+from typing import Sequence
+
+import torch
+from torch import Tensor
+from torch.nn import ModuleList
 from botorch.acquisition import (
+    AcquisitionFunction,
     qExpectedImprovement,
     qUpperConfidenceBound,
     qProbabilityOfImprovement,
     qLogExpectedImprovement
 )
+from botorch.acquisition.monte_carlo import SampleReducingMCAcquisitionFunction
+
+
+class MultiOutputAcquisitionFunction(AcquisitionFunction):
+    """Evaluate several MC acquisition functions on a shared posterior
+
+    The posterior of the model is computed once per forward pass and every
+    acquisition function draws its own MC samples from it. For an input of
+    shape `batch_shape x q x d`, the output has shape `batch_shape x num_acqf`.
+    """
+    def __init__(self, model, acqfs: Sequence[SampleReducingMCAcquisitionFunction]):
+        super().__init__(model)
+        self.acqfs = ModuleList(acqfs)
+
+    def forward(self, X: Tensor) -> Tensor:
+        posterior = self.model.posterior(X)
+        values = []
+        for acqf in self.acqfs:
+            samples = acqf.get_posterior_samples(posterior)
+            obj = acqf.objective(samples=samples, X=X)
+            acqval = acqf._apply_constraints(acqval=acqf._sample_forward(obj), samples=samples)
+            values.append(acqf._sample_reduction(acqf._q_reduction(acqval)))
+        return torch.stack(values, dim=-1)
 
 
 def acqf_factory(acqf_type, model, train_X, train_Y):
@@ -28,11 +28,13 @@ class NSGAIIDesigner(Designer):
 
     _last_pop = field(default=None, init=False)
     _converter: BaseTrialConverter = field(init=False)
+    _input_keys = field(init=False)
     _impl = field(init=False)
     _nsga_problem = field(init=False)
 
     def __attrs_post_init__(self):
         self._converter = DefaultTrialConverter.from_problem(self._problem_statement)
+        self._input_keys = tuple(self._converter.input_converter_dict)
         self._init_nsga()
 
     def _init_nsga(self):
@@ -56,10 +58,7 @@ class NSGAIIDesigner(Designer):
 
     def _suggest(self, count: Optional[int]=None) -> Sequence[Trial]:
         pop = self._impl.ask()
-        X = pop.get('X')
-        features = dict()
-        for i, name in enumerate(self._converter.input_converter_dict):
-            features[name] = X[:, i]
+        features = self._convertX2features(pop.get('X'))
         trials = self._converter.to_trials(features)
         self._last_pop = pop
         return trials
@@ -92,9 +91,7 @@ class NSGAIIDesigner(Designer):
         return self._convert_pop2trials(X, F)
     
     def _convertX2features(self, X):
-        features = dict()
-        for i, name in enumerate(self._converter.input_converter_dict):
-            features[name] = X[:, i]
+        features = {name: X[:, i] for i, name in enumerate(self._input_keys)}
         return features
 
     def _convertF2labels(self, F):
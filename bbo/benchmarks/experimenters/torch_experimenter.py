@@ -1,5 +1,6 @@
-from typing import List, Callable
+from typing import List, Callable, Optional
 
+import torch
 from torch import Tensor
 
 from bbo.benchmarks.experimenters.base import BaseExperimenter
@@ -13,15 +14,22 @@ class TorchExperimenter(BaseExperimenter):
         self,
         impl: Callable[[Tensor], Tensor],
         problem_statement: ProblemStatement,
+        *,
+        device: Optional[torch.device] = None,
+        dtype: Optional[torch.dtype] = None,
     ):
         self._dim = problem_statement.search_space.num_parameters()
         self._impl = impl
         self._problem_statement = problem_statement
+        self._device = device
+        self._dtype = dtype
 
         self._converter = TorchArrayTrialConverter.from_problem(problem_statement, scale=False)
 
     def evaluate(self, suggestions: List[Trial]):
         features = self._converter.to_features(suggestions)
+        # move the features in one copy, so that impl receives them on its device
+        features = features.to(device=self._device, dtype=self._dtype)
         m = self._impl(features)
         metrics = self._converter.to_metrics(m)
         for suggestion, m in zip(suggestions, metrics):
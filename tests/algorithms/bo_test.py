@@ -0,0 +1,124 @@
+import unittest
+
+import numpy as np
+import torch
+
+from bbo.algorithms.bo import BODesigner, _batched_optimize_acqf, _build_next_x, _row_keys
+from bbo.utils.metric_config import Objective, ObjectiveMetricGoal
+from bbo.utils.parameter_config import SearchSpace
+from bbo.utils.problem_statement import ProblemStatement
+from bbo.utils.trial import Trial
+
+
+class BatchedOptimizeAcqfTest(unittest.TestCase):
+    def setUp(self):
+        torch.manual_seed(0)
+        self.bounds = torch.tensor([[0.0, 0.0], [1.0, 1.0]], dtype=torch.float64)
+        # the unconstrained maximizer of the second dimension is outside the bounds
+        self.center = torch.tensor([0.3, 1.5], dtype=torch.float64)
+        self.maximizer = torch.tensor([0.3, 1.0], dtype=torch.float64)
+
+    def acqf(self, X):
+        return - ((X - self.center) ** 2).sum(dim=(-2, -1))
+
+    def test_converge(self):
+        X0 = torch.rand(5, 1, 2, dtype=torch.float64)
+        X, Y = _batched_optimize_acqf(self.acqf, X0, self.bounds)
+        self.assertEqual(X.shape, (5, 1, 2))
+        self.assertEqual(Y.shape, (5,))
+        self.assertTrue(torch.all(X >= self.bounds[0]))
+        self.assertTrue(torch.all(X <= self.bounds[1]))
+        for x in X:
+            self.assertTrue(torch.allclose(x[0], self.maximizer, atol=1e-5))
+
+    def test_values(self):
+        X0 = torch.rand(4, 2, 2, dtype=torch.float64)
+        X, Y = _batched_optimize_acqf(self.acqf, X0, self.bounds, options={'maxiter': 3})
+        self.assertEqual(X.shape, (4, 2, 2))
+        self.assertTrue(torch.allclose(Y, self.acqf(X)))
+
+
+class BuildNextXTest(unittest.TestCase):
+    def setUp(self):
+        self.rng = np.random.default_rng(0)
+        self.pareto_X = np.array([[0.1, 0.2], [0.3, 0.4]])
+
+    def test_row_keys(self):
+        X = np.array([[0.1, 0.2], [0.1, 0.2], [0.2, 0.1]])
+        keys = _row_keys(X)
+        self.assertEqual(keys.shape, (3, ))
+        self.assertEqual(keys[0], keys[1])
+        self.assertNotEqual(keys[0], keys[2])
+        self.assertEqual(_row_keys(np.zeros((0, 2))).shape, (0, ))
+
+    def test_pareto_enough(self):
+        pop_X = np.array([[0.5, 0.6]])
+        pareto_idx, pop_idx = _build_next_x(self.pareto_X, pop_X, 1, self.rng)
+        self.assertEqual(len(pareto_idx), 1)
+        self.assertIn(pareto_idx[0], (0, 1))
+        self.assertEqual(len(pop_idx), 0)
+
+    def test_pareto_smaller_than_q(self):
+        pop_X = np.array([[0.1, 0.2], [0.5, 0.6], [0.3, 0.4], [0.7, 0.8]])
+        pareto_idx, pop_idx = _build_next_x(self.pareto_X, pop_X, 3, self.rng)
+        self.assertEqual(pareto_idx.tolist(), [0, 1])
+        self.assertEqual(len(pop_idx), 1)
+        self.assertIn(pop_idx[0], (1, 3))
+
+    def test_empty_diff(self):
+        pareto_idx, pop_idx = _build_next_x(self.pareto_X, self.pareto_X.copy(), 5, self.rng)
+        self.assertEqual(pareto_idx.tolist(), [0, 1])
+        self.assertEqual(len(pop_idx), 0)
+
+    def test_duplicate_rows(self):
+        # duplicates of Pareto rows are never selected from the population
+        pop_X = np.array([[0.1, 0.2], [0.1, 0.2], [0.5, 0.6], [0.5, 0.6], [0.3, 0.4]])
+        pareto_idx, pop_idx = _build_next_x(self.pareto_X, pop_X, 10, self.rng)
+        self.assertEqual(pareto_idx.tolist(), [0, 1])
+        self.assertEqual(sorted(pop_idx.tolist()), [2, 3])
+
+
+class BODesignerBufferTest(unittest.TestCase):
+    def setUp(self):
+        np.random.seed(0)
+        sp = SearchSpace()
+        sp.add_float_param('float', 0, 10)
+        sp.add_int_param('int', 1, 10)
+        obj = Objective()
+        obj.add_metric('obj', ObjectiveMetricGoal.MINIMIZE)
+        self.problem_statement = ProblemStatement(sp, obj)
+        self.trials = []
+        for _ in range(13):
+            trial = Trial(parameters=sp.sample())
+            trial.complete({'obj': np.random.randn() * 5 + 3})
+            self.trials.append(trial)
+        self.Y = - np.array([t.metrics['obj'].value for t in self.trials]).reshape(-1, 1)
+
+    def assert_moments(self, designer, Y):
+        self.assertEqual(designer._y_n, len(Y))
+        self.assertTrue(np.allclose(designer._y_mean, Y.mean(axis=0)))
+        self.assertTrue(np.allclose(np.sqrt(designer._y_m2 / designer._y_n), Y.std(axis=0)))
+
+    def test_update_moments(self):
+        designer = BODesigner(self.problem_statement)
+        for start, end in ((0, 1), (1, 6), (6, 6), (6, 13)):
+            designer.update(self.trials[start: end])
+            self.assertEqual(designer._X_buf.shape, (end, 2))
+            self.assertTrue(np.allclose(designer._Y_buf, self.Y[:end]))
+            if end > 0:
+                self.assert_moments(designer, self.Y[:end])
+
+    def test_reset(self):
+        designer = BODesigner(self.problem_statement)
+        designer.update(self.trials)
+        X_buf = designer._X_buf.copy()
+
+        designer.reset(self.trials[:4])
+        self.assertEqual(designer._X_buf.shape, (4, 2))
+        self.assertTrue(np.allclose(designer._X_buf, X_buf[:4]))
+        self.assertTrue(np.allclose(designer._Y_buf, self.Y[:4]))
+        self.assert_moments(designer, self.Y[:4])
+
+        designer.reset()
+        self.assertEqual(designer._X_buf.shape, (0, 2))
+        self.assertEqual(designer._y_n, 0)